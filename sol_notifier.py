@@ -1,132 +1,336 @@
-import json, os, requests
+# PIL and numpy are imported lazily inside the render helpers: they cost
+# ~100ms of cold import that non-alert runs (the common case) never need
+from __future__ import annotations
+
+import atexit, functools, io, json, os, time, requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from decimal import Decimal, ROUND_HALF_UP, getcontext
-from PIL import Image, ImageDraw, ImageFont
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 from typing import Tuple
 
-# -------- precision --------
-getcontext().prec = 16
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # -------- config --------
-DELTA = Decimal(os.environ.get("DELTA", "0.01"))   # alert threshold (absolute dollars)
+DELTA = float(os.environ.get("DELTA", "0.01"))   # alert threshold (absolute dollars)
+MIN_ALERT_INTERVAL = float(os.environ.get("MIN_ALERT_INTERVAL", "30"))  # debounce (seconds)
+SOURCE = os.environ.get("SOURCE", "coingecko")   # price source: coingecko | binance
+CARD = os.environ.get("CARD", "banner")          # card style: banner | gradient
 STATE_FILE = "state.json"
 TELEGRAM_BOT_TOKEN = os.environ["TELEGRAM_BOT_TOKEN"]
 TELEGRAM_CHAT_ID = os.environ["TELEGRAM_CHAT_ID"]
 
+# -------- http --------
+# one pooled session so the price fetch and the Telegram upload reuse
+# the same keep-alive connections instead of a fresh TLS handshake each;
+# transient failures retry with exponential backoff
+SESSION = requests.Session()
+SESSION.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=4, pool_maxsize=4,
+    max_retries=requests.adapters.Retry(total=3, backoff_factor=2),
+))
+atexit.register(SESSION.close)
+
+# shared pool: overlaps the price fetch with template prep, and the
+# Telegram upload with the state write
+POOL = ThreadPoolExecutor(max_workers=2)
+atexit.register(POOL.shutdown)
+
 # -------- helpers --------
-def q2(d: Decimal) -> Decimal:
-    return d.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+def q2(d: float) -> float:
+    # doubles are exact to well past cents for any plausible USD price
+    return round(d, 2)
 
-def get_sol_price() -> Decimal:
+def _price_from_coingecko() -> float:
     url = "https://api.coingecko.com/api/v3/simple/price"
     params = {"ids": "solana", "vs_currencies": "usd"}
-    r = requests.get(url, params=params, timeout=15)
+    r = SESSION.get(url, params=params, timeout=15)
+    r.raise_for_status()
+    return float(r.json()["solana"]["usd"])
+
+def _price_from_binance() -> float:
+    url = "https://api.binance.com/api/v3/ticker/price"
+    r = SESSION.get(url, params={"symbol": "SOLUSDT"}, timeout=15)
     r.raise_for_status()
-    return Decimal(r.json()["solana"]["usd"])
+    return float(r.json()["price"])
+
+PRICE_SOURCES = {"coingecko": _price_from_coingecko, "binance": _price_from_binance}
+
+def get_sol_price() -> float:
+    return PRICE_SOURCES[SOURCE]()
 
 def load_state():
-    if not os.path.exists(STATE_FILE):
+    # EAFP: one open() instead of a stat-then-open pair (and no race window)
+    try:
+        with open(STATE_FILE, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
         return {}
-    with open(STATE_FILE, "r") as f:
-        return json.load(f)
+    return orjson.loads(data) if orjson else json.loads(data)
 
 def save_state(s):
-    with open(STATE_FILE, "w") as f:
-        json.dump(s, f)
+    # write-then-rename so a crash mid-write can't truncate state.json
+    payload = orjson.dumps(s) if orjson else json.dumps(s).encode()
+    # leave the file untouched when the content is identical (also keeps
+    # the Actions state-commit step from seeing a spurious diff)
+    try:
+        with open(STATE_FILE, "rb") as f:
+            if f.read() == payload:
+                return
+    except FileNotFoundError:
+        pass
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, STATE_FILE)
 
-def pretty_price(d: Decimal) -> str:
+def pretty_price(d: float) -> str:
     return f"${q2(d):,.2f}"
 
-def _autosize_font(draw, text: str, max_width: int, start: int, path: str):
-    """Decrease font size until text fits within max_width."""
-    size = start
-    while size > 10:
+@functools.lru_cache(maxsize=1)
+def _font_path() -> str:
+    """EAFP: probe candidate fonts by opening them rather than stat-ing first."""
+    for path in ("Inter-Bold.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"):
         try:
-            f = ImageFont.truetype(path, size)
-        except Exception:
-            return ImageFont.load_default()
-        w, _ = draw.textbbox((0, 0), text, font=f)[2:]
-        if w <= max_width:
-            return f
+            _load_font(path, 10)
+            return path
+        except OSError:
+            continue
+    return ""
+
+@functools.lru_cache(maxsize=64)
+def _load_font(path: str, size: int):
+    """FreeType parses the TTF on every truetype() call; cache the handles."""
+    from PIL import ImageFont
+    return ImageFont.truetype(path, size)
+
+@functools.lru_cache(maxsize=256)
+def _glyph_mask(path: str, size: int, ch: str) -> Image.Image:
+    """L-mode raster of a single glyph; price strings reuse these as blits."""
+    from PIL import Image, ImageDraw
+    font = _load_font(path, size)
+    left, top, right, bottom = font.getbbox(ch)
+    im = Image.new("L", (max(right, 1), max(bottom, 1)), 0)
+    ImageDraw.Draw(im).text((0, 0), ch, font=font, fill=255)
+    return im
+
+def _paste_text(img, xy, text: str, path: str, size: int, fill):
+    """Assemble text from cached glyph masks instead of re-rasterizing it."""
+    font = _load_font(path, size)
+    x, y = xy
+    for ch in text:
+        img.paste(fill, (int(x), y), _glyph_mask(path, size, ch))
+        x += font.getlength(ch)
+
+@functools.lru_cache(maxsize=128)
+def _fit_size(text: str, max_width: int, start: int, path: str) -> int:
+    """Largest size fitting max_width, from one reference measurement.
+
+    Glyph advances scale linearly with point size, so one measurement at a
+    reference size gives the target directly instead of a shrink loop.
+    """
+    ref = _load_font(path, 100)
+    w_ref = ref.getlength(text)
+    size = max(10, min(start, int(100 * max_width / max(w_ref, 1))))
+    # hinting can push the exact width a hair over; nudge down a few steps
+    for _ in range(3):
+        if size <= 10 or _load_font(path, size).getlength(text) <= max_width:
+            break
         size -= 2
-    return ImageFont.load_default()
+    return size
+
+def _autosize_font(text: str, max_width: int, start: int, path: str):
+    from PIL import ImageFont
+    try:
+        return _load_font(path, _fit_size(text, max_width, start, path))
+    except Exception:
+        return ImageFont.load_default()
 
 # -------- card rendering --------
-def make_card(price: Decimal, delta: Decimal):
+# ---- layout ----
+W, H = 1200, 628
+RADIUS = 42
+BANNER_FILE = "sol-card.png"
+TEMPLATE_FILE = f"sol_card_template_{CARD}.png"  # per-style cache
 
-    # ---- layout ----
-    W, H = 1200, 628
-    RADIUS = 42
+def _gradient_bg(w: int, h: int) -> Image.Image:
+    """Vertical Solana purple->green gradient, built in one vectorized pass."""
+    import numpy as np
+    from PIL import Image
+    t = np.linspace(0, 1, h, dtype=np.float32)[:, None]
+    start = np.array((153, 69, 255), dtype=np.float32)   # solana purple
+    end = np.array((20, 241, 149), dtype=np.float32)     # solana green
+    row = (start + (end - start) * t).astype(np.uint8)
+    arr = np.broadcast_to(row[:, None, :], (h, w, 3))
+    return Image.fromarray(np.ascontiguousarray(arr), "RGB")
 
-    # ---- fonts ----
-    FONT_BOLD = "Inter-Bold.ttf" if os.path.exists("Inter-Bold.ttf") else "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+@functools.lru_cache(maxsize=4)
+def _round_mask(w: int, h: int, radius: int) -> Image.Image:
+    """Rounded-corner alpha mask; rasterized once per (w, h, radius)."""
+    from PIL import Image, ImageDraw
+    mask = Image.new("L", (w, h), 0)
+    ImageDraw.Draw(mask).rounded_rectangle((0, 0, w, h), radius, fill=255)
+    return mask
+
+def _build_template() -> Image.Image:
+    """Composite the static card base: banner (or gradient) behind rounded corners."""
+    from PIL import Image
+    if CARD == "banner" and os.path.exists(BANNER_FILE):
+        bg = Image.open(BANNER_FILE).convert("RGB")
+        if bg.size != (W, H):
+            # pre-bake the banner to 1200x628 to skip this entirely
+            bg = bg.resize((W, H), Image.LANCZOS)
+    else:
+        bg = _gradient_bg(W, H)
+    # the JPEG output has no alpha, so the corners come out black either
+    # way; staying in RGB avoids two full RGBA round-trips per card
+    corners = Image.new("RGB", (W, H), (0, 0, 0))
+    return Image.composite(bg, corners, _round_mask(W, H, RADIUS))
 
-    # ---- load fixed banner ----
-    bg = Image.open("sol-card.png").convert("RGBA")
-    bg = bg.resize((W, H), Image.LANCZOS)
+_TEMPLATE_CACHE = None  # (banner mtime, Image) — keeps the base warm in loop mode
 
-    # ---- rounded mask ----
-    mask = Image.new("L", (W, H), 0)
-    ImageDraw.Draw(mask).rounded_rectangle((0, 0, W, H), RADIUS, fill=255)
-    card = Image.new("RGBA", (W, H))
-    card.paste(bg, (0, 0), mask)
+def _load_template() -> Image.Image:
+    """Serve the card base from memory, then disk; rebuild only when stale."""
+    global _TEMPLATE_CACHE
+    from PIL import Image
+    banner_mtime = os.path.getmtime(BANNER_FILE) if os.path.exists(BANNER_FILE) else 0
+    if _TEMPLATE_CACHE is not None and _TEMPLATE_CACHE[0] == banner_mtime:
+        return _TEMPLATE_CACHE[1].copy()
+    if os.path.exists(TEMPLATE_FILE) and os.path.getmtime(TEMPLATE_FILE) >= banner_mtime:
+        card = Image.open(TEMPLATE_FILE).convert("RGB")
+    else:
+        card = _build_template()
+        card.save(TEMPLATE_FILE, "PNG", compress_level=1, optimize=False)
+    _TEMPLATE_CACHE = (banner_mtime, card)
+    return card.copy()
+
+def make_card(price: float, delta: float, card: Image.Image = None):
+
+    # ---- fonts ----
+    FONT_BOLD = _font_path()
 
-    # ---- overlay for text ----
-    overlay = Image.new("RGBA", (W, H), (255, 255, 255, 0))
-    dr = ImageDraw.Draw(overlay)
+    # ---- static base (built once, cached on disk) ----
+    if card is None:
+        card = _load_template()
 
     price_str = f"${q2(price):,.2f}"
 
     # autosize price text to fit width
-    font_big = _autosize_font(dr, price_str, W - 200, 160, FONT_BOLD)
+    font_big = _autosize_font(price_str, W - 200, 160, FONT_BOLD)
 
-    _, _, tw, th = dr.textbbox((0, 0), price_str, font=font_big)
+    # measure via font metrics directly — no ImageDraw context needed
+    _, _, tw, th = font_big.getbbox(price_str)
     x = (W - tw) // 2
     y = (H - th) // 2
 
-    # draw price in pure black
-    dr.text((x, y), price_str, font=font_big, fill=(0, 0, 0, 255))
+    # draw price in pure black; the price alphabet is tiny ($ , . 0-9),
+    # so paste cached glyph rasters instead of re-rasterizing via FreeType
+    if hasattr(font_big, "path"):
+        _paste_text(card, (x, y), price_str, font_big.path, font_big.size, (0, 0, 0))
+    else:
+        from PIL import ImageDraw
+        ImageDraw.Draw(card).text((x, y), price_str, font=font_big, fill=(0, 0, 0))
 
-    # ---- merge and save ----
-    final = Image.alpha_composite(card, overlay).convert("RGB")
-    final.save("sol_card.jpg", "JPEG", quality=95, optimize=True)
+    # ---- encode in memory ----
+    buf = io.BytesIO()
+    card.save(buf, "JPEG", quality=90, optimize=False, progressive=False)
+    buf.seek(0)
+    return buf
 
 
-def send_photo_to_telegram(caption=None):
+def send_photo_to_telegram(buf, caption=None):
     url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
-    with open("sol_card.jpg", "rb") as f:  # JPEG now
-        data = {"chat_id": TELEGRAM_CHAT_ID, "caption": caption or "", "parse_mode": "HTML"}
-        files = {"photo": f}
-        requests.post(url, data=data, files=files, timeout=30).raise_for_status()
+    # stream the multipart body straight from the buffer instead of
+    # letting requests copy the whole image again first
+    m = MultipartEncoder(fields={
+        "chat_id": TELEGRAM_CHAT_ID,
+        "caption": caption or "",
+        "parse_mode": "HTML",
+        "photo": ("sol_card.jpg", buf, "image/jpeg"),
+    })
+    SESSION.post(url, data=m, headers={"Content-Type": m.content_type}, timeout=30).raise_for_status()
 
 # -------- main --------
-def main():
-    state = load_state()
+def tick(state):
+    loaded = dict(state)
     last_str = state.get("last_price")
-    price = q2(get_sol_price())
+
+    # overlap the HTTPS round trip with template prep; both are independent
+    f_price = POOL.submit(get_sol_price)
+    f_tpl = POOL.submit(_load_template)
+    price = q2(f_price.result())
+    template = f_tpl.result()
 
     if last_str is None:
-        state["last_price"] = str(price)
+        state["last_price"] = f"{price:.2f}"
         save_state(state)
         print(f"Initialized at {price}")
         return
 
-    last = q2(Decimal(last_str))
+    last = q2(float(last_str))
     delta = price - last
 
     if abs(delta) >= DELTA:
-        make_card(price, delta)
+        # debounce flappy markets: track the price but skip render+upload
+        # if the previous alert fired only moments ago
+        now = time.time()
+        if now - state.get("last_alert_ts", 0) < MIN_ALERT_INTERVAL:
+            state["last_price"] = f"{price:.2f}"
+            if state != loaded:
+                save_state(state)
+            print(f"Debounced: Δ={delta:+.2f} within {MIN_ALERT_INTERVAL:.0f}s of last alert")
+            return
+
+        # identical price+direction renders an identical card; reuse it
+        card_key = f"{price:.2f}|{'up' if delta > 0 else 'dn'}"
+        if card_key != state.get("last_card_key") or not os.path.exists("sol_card.jpg"):
+            buf = make_card(price, delta, template)
+            # keep the on-disk copy so an identical follow-up alert can reuse it
+            with open("sol_card.jpg", "wb") as f:
+                f.write(buf.getbuffer())
+            buf.seek(0)
+        else:
+            with open("sol_card.jpg", "rb") as f:
+                buf = io.BytesIO(f.read())
 
         # caption emoji by direction
         emoji = "📈" if delta > 0 else ("📉" if delta < 0 else "〰️")
         caption = f"{emoji} {pretty_price(price)} @solpriceticker"
 
-        send_photo_to_telegram(caption)
-        state["last_price"] = str(price)
-        save_state(state)
+        # upload in the background while the state write happens here;
+        # result() re-raises any upload failure before we report success
+        fut = POOL.submit(send_photo_to_telegram, buf, caption)
+        state["last_alert_ts"] = now
+        state["last_card_key"] = card_key
+        state["last_price"] = f"{price:.2f}"
+        if state != loaded:
+            save_state(state)
+        fut.result(timeout=60)
         print(f"Posted change {delta:+.2f}, new last_price={price}")
     else:
         print(f"No alert: Δ={delta:+.2f}, threshold={DELTA:.2f}")
 
+def main():
+    tick(load_state())
+
+def run_loop(interval: float):
+    """Long-lived mode: keeps the session, fonts, template and state warm across polls."""
+    state = load_state()
+    while True:
+        try:
+            tick(state)
+        except Exception as e:
+            print(f"Poll failed: {e}")
+        time.sleep(interval)
+
 if __name__ == "__main__":
-    main()
+    # one-shot by default (cron / GitHub Actions); set POLL_INTERVAL to daemonize
+    poll = os.environ.get("POLL_INTERVAL")
+    if poll:
+        run_loop(float(poll))
+    else:
+        main()